@@ -5,7 +5,7 @@ import plotly.graph_objects as go
 from scipy.signal import find_peaks
 import matplotlib #this is in case we will need to suppress mne matplotlib plots
 from copy import deepcopy
-from scipy.ndimage import gaussian_filter
+from scipy.ndimage import gaussian_filter, gaussian_filter1d
 from scipy.stats import pearsonr
 from meg_qc.source.universal_html_report import simple_metric_basic
 from meg_qc.source.universal_plots import QC_derivative, get_tit_and_unit, plot_df_of_channels_data_as_lines_by_lobe
@@ -50,7 +50,11 @@ def check_3_conditions(ch_data: list or np.ndarray, fs: int, ecg_or_eog: str, n_
 
     # 1. Check if R peaks (or EOG peaks)  have similar amplitude. If not - data is too noisy:
     # Find R peaks (or peaks of EOG wave) using find_peaks
-    height = np.mean(ch_data) + height_multiplier * np.std(ch_data)
+    # mean is calculated once and reused for std (np.std would calculate it again), squares are summed by np.dot without another temporary array:
+    ch_data_mean = np.mean(ch_data)
+    ch_data_centered = ch_data - ch_data_mean
+    ch_data_std = np.sqrt(np.dot(ch_data_centered, ch_data_centered) / len(ch_data_centered))
+    height = ch_data_mean + height_multiplier * ch_data_std
     peaks, _ = find_peaks(ch_data, height=height, distance=round(0.5 * fs)) #assume there are no peaks within 0.5 seconds from each other.
 
 
@@ -58,8 +62,9 @@ def check_3_conditions(ch_data: list or np.ndarray, fs: int, ecg_or_eog: str, n_
     # are the peak magnitudes the same on average or not? Since absolute values and hence mean and std 
     # can be different for different data sets, we can just scale everything between 0 and 1 and then
     # compare the peak magnitudes
-    ch_data_scaled = (ch_data - np.min(ch_data))/(np.max(ch_data) - np.min(ch_data))
-    peak_amplitudes = ch_data_scaled[peaks]
+    # Only the peak amplitudes are scaled, scaling the whole channel would be an extra pass over (and copy of) the data:
+    ch_data_min = np.min(ch_data)
+    peak_amplitudes = (ch_data[peaks] - ch_data_min)/(np.max(ch_data) - ch_data_min)
 
     amplitude_std = np.std(peak_amplitudes)
 
@@ -71,23 +76,20 @@ def check_3_conditions(ch_data: list or np.ndarray, fs: int, ecg_or_eog: str, n_
         print("___MEG QC___: Peaks do not have similar amplitudes, amplitude std: ", amplitude_std)
 
 
-    # 2. Calculate RR intervals (time differences between consecutive R peaks)
-    rr_intervals = np.diff(peaks) / fs
+    # 2. Calculate RR intervals (distances between consecutive R peaks). Kept in samples:
+    # the allowed range is converted to samples once instead of dividing every interval by fs.
+    rr_intervals = np.diff(peaks)
 
     if ecg_or_eog == 'ECG':
         rr_dist_allowed = [0.6, 1.6] #take possible pulse rate of 100-40 bpm (hense distance between peaks is 0.6-1.6 seconds)
     elif ecg_or_eog == 'EOG':
         rr_dist_allowed = [1, 10] #take possible blink rate of 60-5 per minute (hense distance between peaks is 1-10 seconds). Yes, 60 is a very high rate, but I see this in some data sets often.
 
+    rr_samples_allowed = [rr_dist_allowed[0] * fs, rr_dist_allowed[1] * fs]
 
     #Count how many segment there are in rr_intervals with breaks or bursts:
-    n_breaks = 0
-    n_bursts = 0
-    for i in range(len(rr_intervals)):
-        if rr_intervals[i] > rr_dist_allowed[1]:
-            n_breaks += 1
-        if rr_intervals[i] < rr_dist_allowed[0]:
-            n_bursts += 1
+    n_breaks = np.count_nonzero(rr_intervals > rr_samples_allowed[1])
+    n_bursts = np.count_nonzero(rr_intervals < rr_samples_allowed[0])
 
     no_breaks, no_bursts = True, True
     #Check if there are too many breaks:
@@ -217,7 +219,7 @@ def detect_noisy_ecg(raw: mne.io.Raw, ecg_ch: str,  ecg_or_eog: str, n_breaks_bu
     return bad_ecg_eog, ch_data, peaks, ecg_eval
 
 
-def find_epoch_peaks(ch_data: np.ndarray, thresh_lvl_peakfinder: float):
+def find_epoch_peaks(ch_data: np.ndarray, thresh_lvl_peakfinder: float, thresh_mean: float = None):
     
     """
     Find the peaks in the epoch data using the peakfinder algorithm.
@@ -228,6 +230,9 @@ def find_epoch_peaks(ch_data: np.ndarray, thresh_lvl_peakfinder: float):
         The data of the channel.
     thresh_lvl_peakfinder : float
         The threshold for the peakfinder algorithm.
+    thresh_mean : float, optional
+        Precomputed prominence threshold: ptp of ch_data / thresh_lvl_peakfinder. 
+        Useful when it was calculated for many channels at once. If None - calculated here. The default is None.
 
     Returns
     -------
@@ -244,39 +249,73 @@ def find_epoch_peaks(ch_data: np.ndarray, thresh_lvl_peakfinder: float):
     """
 
 
-    thresh_mean=(max(ch_data) - min(ch_data)) / thresh_lvl_peakfinder
+    if thresh_mean is None:
+        thresh_mean=np.ptp(ch_data) / thresh_lvl_peakfinder #np.ptp instead of python max()-min(), which iterate element by element
     peak_locs_pos, _ = find_peaks(ch_data, prominence=thresh_mean)
     peak_locs_neg, _ = find_peaks(-ch_data, prominence=thresh_mean)
 
-    try:
-        peak_magnitudes_pos=ch_data[peak_locs_pos]
-    except:
-        peak_magnitudes_pos=np.empty(0)
-
-    try:
-        peak_magnitudes_neg=ch_data[peak_locs_neg]
-    except:
-        peak_magnitudes_neg=np.empty(0)
+    #find_peaks always returns an integer array (empty if nothing was found), indexing with it gives an empty array, no need to catch anything:
+    peak_magnitudes_pos=ch_data[peak_locs_pos]
+    peak_magnitudes_neg=ch_data[peak_locs_neg]
 
     return peak_locs_pos, peak_locs_neg, peak_magnitudes_pos, peak_magnitudes_neg
 
 
+def find_peaks_and_wave_shape(ch_data: np.ndarray, max_n_peaks_allowed: int, thresh_lvl_peakfinder: float, thresh_mean: float = None):
+
+    """
+    Find all peaks (positive and negative) in the average artifact epoch and decide if the epoch has wave shape:
+    few peaks (different number allowed for ECG and EOG) - wave shape, many or no peaks - not.
+    Shared by Avg_artif.get_peaks_wave() and Avg_artif.get_peaks_wave_smoothed().
+
+    Parameters
+    ----------
+    ch_data : np.ndarray
+        The data of the artifact epoch (original or smoothed).
+    max_n_peaks_allowed : int
+        maximum number of peaks allowed in the average artifact epoch
+    thresh_lvl_peakfinder : float
+        threshold for peakfinder function.
+    thresh_mean : float, optional
+        precomputed prominence threshold, see find_epoch_peaks(). If None - calculated from the data.
+
+    Returns
+    -------
+    peak_loc : np.ndarray
+        Locations of all peaks: positive first, then negative.
+    peak_magnitude : np.ndarray
+        Magnitudes of all peaks.
+    wave_shape : bool
+        True if the epoch has wave shape.
+
+    """
+
+    peak_locs_pos, peak_locs_neg, _, _ = find_epoch_peaks(ch_data=ch_data, thresh_lvl_peakfinder=thresh_lvl_peakfinder, thresh_mean=thresh_mean)
+
+    peak_loc=np.concatenate((peak_locs_pos, peak_locs_neg))
+    peak_magnitude=ch_data[peak_loc] #one lookup for all peaks instead of concatenating pos and neg magnitudes
+
+    wave_shape = 1 <= len(peak_loc) <= max_n_peaks_allowed #no peaks or too many peaks - no wave shape
+
+    return peak_loc, peak_magnitude, wave_shape
+
+
 class Avg_artif:
     
     """ 
     Instance of this class:
 
     - contains average ECG/EOG epoch for a particular channel,
-    - calculates its main peak (location and magnitude), possibe on both smoothed and non smoothed data.
-    - evaluates if this epoch is concidered as artifact or not based on the main peak amplitude.
+    - holds its main peak (location and magnitude), possibe on both smoothed and non smoothed data.
+    - holds if this epoch is concidered as artifact or not based on the main peak amplitude (both set in detect_channels_above_norm()).
     
 
     Attributes
     ----------
     name : str
         name of the channel
-    artif_data : list
-        list of floats, average ecg epoch for a particular channel
+    artif_data : np.ndarray
+        average ecg epoch for a particular channel
     peak_loc : int
         locations of peaks inside the artifact epoch
     peak_magnitude : float
@@ -289,8 +328,8 @@ class Avg_artif:
         location of the main peak inside the artifact epoch
     main_peak_magnitude : float
         magnitude of the main peak inside the artifact epoch
-    artif_data_smoothed : list
-        list of floats, average ecg epoch for a particular channel, smoothed usig Gaussian filter
+    artif_data_smoothed : np.ndarray
+        average ecg epoch for a particular channel, smoothed usig Gaussian filter
     peak_loc_smoothed : int
         locations of peaks inside the artifact epoch calculated on smoothed data
     peak_magnitude_smoothed : float
@@ -322,21 +361,26 @@ class Avg_artif:
     __repr__(self)
         Returns a string representation of the object
 
-        
+
     """
 
+    #one object is created per channel, so skip the per-instance __dict__:
+    __slots__ = ('name', 'artif_data', 'peak_loc', 'peak_magnitude', 'wave_shape', 'artif_over_threshold', 'main_peak_loc', 'main_peak_magnitude',
+        'artif_data_smoothed', 'peak_loc_smoothed', 'peak_magnitude_smoothed', 'wave_shape_smoothed', 'artif_over_threshold_smoothed', 'main_peak_loc_smoothed', 'main_peak_magnitude_smoothed',
+        'corr_coef', 'p_value', 'lobe', 'color')
+
     def __init__(self, name: str, artif_data:list, peak_loc=None, peak_magnitude=None, wave_shape:bool=None, artif_over_threshold:bool=None, main_peak_loc: int=None, main_peak_magnitude: float=None, artif_data_smoothed: list or None = None, peak_loc_smoothed=None, peak_magnitude_smoothed=None, wave_shape_smoothed:bool=None, artif_over_threshold_smoothed:bool=None, main_peak_loc_smoothed: int=None, main_peak_magnitude_smoothed: float=None, corr_coef: float = None, p_value: float = None, lobe: str = None, color: str = None):
         """Constructor"""
         
         self.name =  name
-        self.artif_data = artif_data
+        self.artif_data = np.ascontiguousarray(artif_data) if artif_data is not None else None #coerce once, so methods dont need to re-wrap it into arrays
         self.peak_loc = peak_loc
         self.peak_magnitude = peak_magnitude
         self.wave_shape =  wave_shape
         self.artif_over_threshold = artif_over_threshold
         self.main_peak_loc = main_peak_loc
         self.main_peak_magnitude = main_peak_magnitude
-        self.artif_data_smoothed = artif_data_smoothed
+        self.artif_data_smoothed = np.ascontiguousarray(artif_data_smoothed) if artif_data_smoothed is not None else None
         self.peak_loc_smoothed = peak_loc_smoothed
         self.peak_magnitude_smoothed = peak_magnitude_smoothed
         self.wave_shape_smoothed =  wave_shape_smoothed
@@ -359,7 +403,7 @@ class Avg_artif:
     
 
 
-    def get_peaks_wave(self, max_n_peaks_allowed: int, thresh_lvl_peakfinder: float):
+    def get_peaks_wave(self, max_n_peaks_allowed: int, thresh_lvl_peakfinder: float, thresh_mean: float = None):
 
         """
         Find peaks in the average artifact epoch and decide if the epoch has wave shape: 
@@ -372,26 +416,16 @@ class Avg_artif:
             maximum number of peaks allowed in the average artifact epoch
         thresh_lvl_peakfinder : float
             threshold for peakfinder function.
+        thresh_mean : float, optional
+            precomputed prominence threshold for this epoch, see find_epoch_peaks(). If None - calculated from the data.
         
             
         """
 
-        peak_locs_pos_orig, peak_locs_neg_orig, peak_magnitudes_pos_orig, peak_magnitudes_neg_orig = find_epoch_peaks(ch_data=self.artif_data, thresh_lvl_peakfinder=thresh_lvl_peakfinder)
-        
-        self.peak_loc=np.concatenate((peak_locs_pos_orig, peak_locs_neg_orig), axis=None)
-        self.peak_magnitude=np.concatenate((peak_magnitudes_pos_orig, peak_magnitudes_neg_orig), axis=None)
-
-        if np.size(self.peak_loc)==0: #no peaks found
-            self.wave_shape=False
-        elif 1<=len(self.peak_loc)<=max_n_peaks_allowed:
-            self.wave_shape=True
-        elif len(self.peak_loc)>max_n_peaks_allowed:
-            self.wave_shape=False
-        else:
-            print('Something went wrong with peak detection')
+        self.peak_loc, self.peak_magnitude, self.wave_shape = find_peaks_and_wave_shape(self.artif_data, max_n_peaks_allowed, thresh_lvl_peakfinder, thresh_mean)
 
 
-    def get_peaks_wave_smoothed(self, gaussian_sigma: int, max_n_peaks_allowed: int, thresh_lvl_peakfinder: float):
+    def get_peaks_wave_smoothed(self, gaussian_sigma: int, max_n_peaks_allowed: int, thresh_lvl_peakfinder: float, thresh_mean: float = None):
 
         """
         Find peaks in the average artifact epoch and decide if the epoch has wave shape: 
@@ -406,6 +440,8 @@ class Avg_artif:
             maximum number of peaks allowed in the average artifact epoch
         thresh_lvl_peakfinder : float
             threshold for peakfinder function.
+        thresh_mean : float, optional
+            precomputed prominence threshold for the smoothed epoch, see find_epoch_peaks(). If None - calculated from the data.
 
         
         """
@@ -413,19 +449,7 @@ class Avg_artif:
         if self.artif_data_smoothed is None: #if no smoothed data available yet
             self.smooth_artif(gaussian_sigma) 
 
-        peak_locs_pos_smoothed, peak_locs_neg_smoothed, peak_magnitudes_pos_smoothed, peak_magnitudes_neg_smoothed = find_epoch_peaks(ch_data=self.artif_data_smoothed, thresh_lvl_peakfinder=thresh_lvl_peakfinder)
-        
-        self.peak_loc_smoothed=np.concatenate((peak_locs_pos_smoothed, peak_locs_neg_smoothed), axis=None)
-        self.peak_magnitude_smoothed=np.concatenate((peak_magnitudes_pos_smoothed, peak_magnitudes_neg_smoothed), axis=None)
-
-        if np.size(self.peak_loc_smoothed)==0:
-            self.wave_shape_smoothed=False
-        elif 1<=len(self.peak_loc_smoothed)<=max_n_peaks_allowed:
-            self.wave_shape_smoothed=True
-        elif len(self.peak_loc_smoothed)>max_n_peaks_allowed:
-            self.wave_shape_smoothed=False
-        else:
-            print('Something went wrong with peak detection')
+        self.peak_loc_smoothed, self.peak_magnitude_smoothed, self.wave_shape_smoothed = find_peaks_and_wave_shape(self.artif_data_smoothed, max_n_peaks_allowed, thresh_lvl_peakfinder, thresh_mean)
 
 
     def plot_epoch_and_peak(self, t: np.ndarray, fig_tit: str, ch_type: str, fig: go.Figure = None, plot_original: bool = True, plot_smoothed: bool = True):
@@ -437,7 +461,7 @@ class Avg_artif:
         Parameters
         ----------
         t : list
-            time vector as numpy array. It can be created as: t = np.round(np.arange(tmin, tmax+1/sfreq, 1/sfreq), 3) #yes, you need to round
+            time vector as numpy array. It can be created from sample indexes as: t = np.arange(round(tmin*sfreq), round(tmax*sfreq)+1) / sfreq
         fig_tit: str
             title of the figure not including ch type.
         ch_type: str
@@ -465,16 +489,16 @@ class Avg_artif:
         fig_ch_tit, unit = get_tit_and_unit(ch_type)
 
         if plot_original is True and self.artif_data is not None:
-            fig.add_trace(go.Scatter(x=np.array(t), y=np.array(self.artif_data), name=self.name, legendgroup='Original data', legendgrouptitle=dict(text='Original data')))
-            fig.add_trace(go.Scatter(x=np.array(t[self.peak_loc]), y=self.peak_magnitude, mode='markers', name='peak: '+self.name, legendgroup='Original data', legendgrouptitle=dict(text='Original data')))
+            fig.add_trace(go.Scatter(x=t, y=self.artif_data, name=self.name, legendgroup='Original data', legendgrouptitle=dict(text='Original data')))
+            fig.add_trace(go.Scatter(x=t[self.peak_loc], y=self.peak_magnitude, mode='markers', name='peak: '+self.name, legendgroup='Original data', legendgrouptitle=dict(text='Original data')))
         elif plot_original is True and self.artif_data is None:
             print("Artifact contains no original data!")
         else:
             pass
         
         if plot_smoothed is True and self.artif_data_smoothed is not None:
-            fig.add_trace(go.Scatter(x=np.array(t), y=np.array(self.artif_data_smoothed), name=self.name, legendgroup='Smoothed data', legendgrouptitle=dict(text='Smoothed data')))
-            fig.add_trace(go.Scatter(x=np.array(t[self.peak_loc_smoothed]), y=self.peak_magnitude_smoothed, mode='markers', name='peak: '+self.name, legendgroup='Smoothed data', legendgrouptitle=dict(text='Smoothed data')))
+            fig.add_trace(go.Scatter(x=t, y=self.artif_data_smoothed, name=self.name, legendgroup='Smoothed data', legendgrouptitle=dict(text='Smoothed data')))
+            fig.add_trace(go.Scatter(x=t[self.peak_loc_smoothed], y=self.peak_magnitude_smoothed, mode='markers', name='peak: '+self.name, legendgroup='Smoothed data', legendgrouptitle=dict(text='Smoothed data')))
         elif plot_smoothed is True and self.artif_data_smoothed is None:
             print("Plot of smoothed data was requested, but smoothing was not performed yet.")
         else:
@@ -497,99 +521,6 @@ class Avg_artif:
         return fig
 
 
-    def get_highest_peak(self, t: np.ndarray, timelimit_min: float, timelimit_max: float):
-
-        """
-        Find the highest peak of the artifact epoch inside the give time window. 
-        Time window is centered around the t0 of the ecg/eog event and limited by timelimit_min and timelimit_max.
-        
-
-        Parameters
-        ----------
-        t : list
-            time vector
-        timelimit_min : float
-            minimum time limit for the peak
-        timelimit_max : float
-            maximum time limit for the peak
-            
-        Returns
-        -------
-        main_peak_loc : int
-            location of the main peak
-        main_peak_magnitude : float
-            magnitude of the main peak
-        
-        """
-
-        if self.peak_loc is None: #if no peaks were found on original data:
-            self.main_peak_magnitude=None
-            self.main_peak_loc=None
-        elif self.peak_loc is not None: #if peaks were found on original data:
-            self.main_peak_magnitude = -1000
-            for peak_loc in self.peak_loc:
-                if timelimit_min<t[peak_loc]<timelimit_max: #if peak is inside the timelimit_min and timelimit_max was found:
-                    if self.artif_data[peak_loc] > self.main_peak_magnitude: #if this peak is higher than the previous one:
-                        self.main_peak_magnitude=self.artif_data[peak_loc]
-                        self.main_peak_loc=peak_loc 
-    
-            if self.main_peak_magnitude == -1000: #if no peak was found inside the timelimit_min and timelimit_max:
-                self.main_peak_magnitude=None
-                self.main_peak_loc=None
-        else:
-            self.main_peak_loc, self.main_peak_magnitude = None, None
-
-
-        return self.main_peak_loc, self.main_peak_magnitude
-    
-    def get_highest_peak_smoothed(self, t: np.ndarray, timelimit_min: float, timelimit_max: float):
-
-        """
-        Find the highest peak of the artifact epoch inside the give time window on SMOOTHED data.
-        Time window is centered around the t0 of the ecg/eog event and limited by timelimit_min and timelimit_max.
-        
-        
-        Parameters
-        ----------
-        t : list
-            time vector
-        timelimit_min : float
-            minimum time limit for the peak
-        timelimit_max : float
-            maximum time limit for the peak
-            
-        Returns
-        -------
-        main_peak_magnitude_smoothed : float
-            magnitude of the main peak on smoothed data
-        main_peak_loc_smoothed : int
-            location of the main peak on smoothed data
-        
-        
-        """
-
-        if self.peak_loc_smoothed is None:
-            self.main_peak_magnitude_smoothed=None
-            self.main_peak_loc_smoothed=None
-        elif self.peak_loc_smoothed is not None:
-            self.main_peak_magnitude_smoothed = -1000
-            for peak_loc in self.peak_loc_smoothed:
-                if timelimit_min<t[peak_loc]<timelimit_max:
-                    if self.artif_data_smoothed[peak_loc] > self.main_peak_magnitude_smoothed:
-                        self.main_peak_magnitude_smoothed=self.artif_data_smoothed[peak_loc]
-                        self.main_peak_loc_smoothed=peak_loc 
-    
-            if self.main_peak_magnitude_smoothed == -1000:
-                self.main_peak_magnitude_smoothed=None
-                self.main_peak_loc_smoothed=None
-
-        else:    
-            self.main_peak_loc_smoothed, self.main_peak_magnitude_smoothed = None, None
-
-
-        return self.main_peak_loc_smoothed, self.main_peak_magnitude_smoothed
-    
-    
     def smooth_artif(self, gauss_sigma: int):
 
         """ 
@@ -628,10 +559,11 @@ class Avg_artif:
         
         """
 
+        #flip in place: no new arrays are allocated
         if self.artif_data is not None:
-            self.artif_data = -self.artif_data
+            np.negative(self.artif_data, out=self.artif_data)
         if self.peak_magnitude is not None:
-            self.peak_magnitude = -self.peak_magnitude
+            np.negative(self.peak_magnitude, out=self.peak_magnitude)
 
         return self
     
@@ -650,87 +582,66 @@ class Avg_artif:
         """
 
         if self.artif_data_smoothed is not None:
-            self.artif_data_smoothed = -self.artif_data_smoothed
+            np.negative(self.artif_data_smoothed, out=self.artif_data_smoothed)
         
         if self.peak_magnitude_smoothed is not None:
-            self.peak_magnitude_smoothed = -self.peak_magnitude_smoothed
+            np.negative(self.peak_magnitude_smoothed, out=self.peak_magnitude_smoothed)
 
         return self
 
-    def detect_artif_above_threshold(self, artif_threshold_lvl: float, t: np.ndarray, timelimit_min: float, timelimit_max: float):
 
-        """
-        Detect if the highest peak of the artifact epoch is above a given threshold.
-        Time window is centered around the t0 of the ecg/eog event and limited by timelimit_min and timelimit_max.
-
-        Parameters
-        ----------
-        artif_threshold_lvl : float
-            threshold level
-        t : list
-            time vector
-        timelimit_min : float
-            minimum time limit for the peak
-        timelimit_max : float
-            maximum time limit for the peak
+def find_highest_peaks_in_window(artif_data_all: np.ndarray, peak_locs_all: list, ind_min: int, ind_max: int):
 
-        Returns
-        -------
-        self.artif_over_threshold : bool
-            True if the highest peak is above the threshold, False otherwise
+    """
+    Find the highest peak inside the time window for all channels at once.
+    Only the peaks found before by the peak finder (peak_loc of each channel) are taken into account,
+    the window is given as indexes of the time vector: ind_min <= peak_loc < ind_max.
+    The highest peak is the one with the largest (not absolute) value in artif_data.
+    Channels without peaks (peak_loc is None) or without peaks inside the window get has_peak False.
 
-        """
+    Parameters
+    ----------
+    artif_data_all : np.ndarray
+        Artifact epochs of all channels, shape (n_channels, n_times).
+    peak_locs_all : list
+        List of arrays with peak locations of each channel.
+    ind_min : int
+        first index of the time window
+    ind_max : int
+        index after the end of the time window
 
-        if self.artif_data is not None:
-            #find the highest peak inside the timelimit_min and timelimit_max:
-            _, main_peak_magnitude_orig = self.get_highest_peak(t=t, timelimit_min=timelimit_min, timelimit_max=timelimit_max)
-            if main_peak_magnitude_orig is not None:
-                if main_peak_magnitude_orig>abs(artif_threshold_lvl) and self.wave_shape is True:
-                    self.artif_over_threshold=True
-                else:
-                    self.artif_over_threshold=False
-            else:
-                self.artif_over_threshold=False
-        
-        return self.artif_over_threshold
+    Returns
+    -------
+    has_peak : np.ndarray
+        Boolean array: True if the channel has any peak inside the time window.
+    main_peak_loc : np.ndarray
+        Location of the highest peak inside the time window for each channel (only valid where has_peak is True).
+    main_peak_magnitude : np.ndarray
+        Magnitude of the highest peak inside the time window for each channel (only valid where has_peak is True).
 
+    """
 
-    def detect_artif_above_threshold_smoothed(self, artif_threshold_lvl: float, t: np.ndarray, timelimit_min: float, timelimit_max: float):
+    n_ch = artif_data_all.shape[0]
 
-        """
-        Detect if the highest peak of the artifact epoch is above a given threshold for SMOOTHED data.
-        Time window is centered around the t0 of the ecg/eog event and limited by timelimit_min and timelimit_max.
+    if ind_max <= ind_min:
+        #empty time window: no channel can have a peak inside (argmax on an empty window would fail)
+        return np.zeros(n_ch, dtype=bool), np.zeros(n_ch, dtype=int), np.full(n_ch, -np.inf)
 
-        Parameters
-        ----------
-        artif_threshold_lvl : float
-            threshold level
-        t : list
-            time vector
-        timelimit_min : float
-            minimum time limit for the peak
-        timelimit_max : float
-            maximum time limit for the peak
+    #mark all peaks of all channels in one boolean array of the same shape as data:
+    peak_locs_all = [np.empty(0, dtype=int) if peak_loc is None else np.asarray(peak_loc, dtype=int) for peak_loc in peak_locs_all]
+    peak_mask = np.zeros(artif_data_all.shape, dtype=bool)
+    peak_mask[np.repeat(np.arange(n_ch), [len(peak_loc) for peak_loc in peak_locs_all]), np.concatenate(peak_locs_all)] = True
 
-        Returns
-        -------
-        self.artif_over_threshold : bool
-            True if the highest peak is above the threshold, False otherwise
+    #keep only the peaks inside the time window, everything else can never be the highest:
+    peak_mask_window = peak_mask[:, ind_min:ind_max]
+    peak_values_window = np.where(peak_mask_window, artif_data_all[:, ind_min:ind_max], -np.inf)
 
-        """
+    has_peak = peak_mask_window.any(axis=1)
+    highest = np.argmax(peak_values_window, axis=1)
+    main_peak_loc = ind_min + highest
+    main_peak_magnitude = peak_values_window[np.arange(n_ch), highest]
 
-        if self.artif_data_smoothed is not None:
-            #find the highest peak inside the timelimit_min and timelimit_max:
-            _, main_peak_magnitude_smoothed = self.get_highest_peak(t=t, timelimit_min=timelimit_min, timelimit_max=timelimit_max)
-            if main_peak_magnitude_smoothed is not None:
-                if main_peak_magnitude_smoothed>abs(artif_threshold_lvl) and self.wave_shape_smoothed is True:
-                    self.artif_over_threshold_smoothed=True
-                else:
-                    self.artif_over_threshold_smoothed=False
-            else:
-                self.artif_over_threshold_smoothed=False
-
-        return self.artif_over_threshold_smoothed
+    return has_peak, main_peak_loc, main_peak_magnitude
 
 
 def detect_channels_above_norm(norm_lvl: float, list_mean_artif_epochs: list, mean_magnitude_peak: float, t: np.ndarray, t0_actual: float, window_size_for_mean_threshold_method: float, mean_magnitude_peak_smoothed: float = None, t0_actual_smoothed: float = None):
@@ -738,6 +649,8 @@ def detect_channels_above_norm(norm_lvl: float, list_mean_artif_epochs: list, me
 
     """
     Find the channels which got average artifact amplitude higher than the average over all channels*norm_lvl.
+    A channel is affected if it has wave shape and the highest peak inside the time window around t0 (see find_highest_peaks_in_window())
+    is above the threshold. If there is no peak inside the window, the channel is not affected.
     
     Parameters
     ----------
@@ -779,6 +692,11 @@ def detect_channels_above_norm(norm_lvl: float, list_mean_artif_epochs: list, me
     timelimit_min=-window_size_for_mean_threshold_method+t0_actual
     timelimit_max=window_size_for_mean_threshold_method+t0_actual
 
+    #convert the time window to indexes of t once here, instead of looking up peak times in t for every channel.
+    #t is sorted: index >= ind_min means t>timelimit_min, index < ind_max means t<timelimit_max
+    ind_min=np.searchsorted(t, timelimit_min, side='right')
+    ind_max=np.searchsorted(t, timelimit_max, side='left')
+
 
     #Find the channels which got peaks over this mean:
     affected_orig=[]
@@ -794,18 +712,49 @@ def detect_channels_above_norm(norm_lvl: float, list_mean_artif_epochs: list, me
         artifact_lvl_smoothed=mean_magnitude_peak_smoothed/norm_lvl  #SO WHEN USING SMOOTHED CHANNELS - USE SMOOTHED AVERAGE TOO!
         timelimit_min_smoothed=-window_size_for_mean_threshold_method+t0_actual_smoothed
         timelimit_max_smoothed=window_size_for_mean_threshold_method+t0_actual_smoothed
+        ind_min_smoothed=np.searchsorted(t, timelimit_min_smoothed, side='right')
+        ind_max_smoothed=np.searchsorted(t, timelimit_max_smoothed, side='left')
+
+
+    if not list_mean_artif_epochs:
+        #no channels to check (np.stack needs at least one array):
+        return affected_orig, not_affected_orig, artif_threshold_lvl, affected_smoothed, not_affected_smoothed, artifact_lvl_smoothed
 
+    #find the highest peak in the time window and compare it to the threshold for all channels at once:
+    artif_data_all = np.stack([ch.artif_data for ch in list_mean_artif_epochs])
+    peak_locs_all = [ch.peak_loc for ch in list_mean_artif_epochs]
+    has_peak, main_peak_loc, main_peak_magnitude = find_highest_peaks_in_window(artif_data_all, peak_locs_all, ind_min, ind_max)
+    wave_shape = np.array([ch.wave_shape is True for ch in list_mean_artif_epochs], dtype=bool)
+    over_threshold = has_peak & wave_shape & (main_peak_magnitude > abs(artif_threshold_lvl))
+
+    #smoothed check: the highest peak of the ORIGINAL data is searched in the time window around t0_actual_smoothed and compared to the smoothed threshold.
+    #It overwrites main_peak_loc and main_peak_magnitude of the channels with smoothed data. Channels without smoothed data are not checked.
+    has_peak_smoothed, main_peak_loc_smoothed, main_peak_magnitude_smoothed = find_highest_peaks_in_window(artif_data_all, peak_locs_all, ind_min_smoothed, ind_max_smoothed)
+    wave_shape_smoothed = np.array([ch.wave_shape_smoothed is True for ch in list_mean_artif_epochs], dtype=bool)
+    over_threshold_smoothed = has_peak_smoothed & wave_shape_smoothed & (main_peak_magnitude_smoothed > abs(artifact_lvl_smoothed))
+
+    #store the results in the channel objects and sort them:
+    for i, potentially_affected in enumerate(list_mean_artif_epochs):
+
+        if has_peak[i]:
+            potentially_affected.main_peak_loc, potentially_affected.main_peak_magnitude = int(main_peak_loc[i]), float(main_peak_magnitude[i])
+        else:
+            potentially_affected.main_peak_loc, potentially_affected.main_peak_magnitude = None, None
+        potentially_affected.artif_over_threshold = bool(over_threshold[i])
 
-    for potentially_affected in list_mean_artif_epochs:
+        if potentially_affected.artif_data_smoothed is not None:
+            if has_peak_smoothed[i]:
+                potentially_affected.main_peak_loc, potentially_affected.main_peak_magnitude = int(main_peak_loc_smoothed[i]), float(main_peak_magnitude_smoothed[i])
+            else:
+                potentially_affected.main_peak_loc, potentially_affected.main_peak_magnitude = None, None
+            potentially_affected.artif_over_threshold_smoothed = bool(over_threshold_smoothed[i])
 
-        result = potentially_affected.detect_artif_above_threshold(artif_threshold_lvl, t, timelimit_min, timelimit_max)
-        if result is True:
+        if potentially_affected.artif_over_threshold is True:
             affected_orig.append(potentially_affected)
         else:
             not_affected_orig.append(potentially_affected)
-        
-        result_smoothed = potentially_affected.detect_artif_above_threshold_smoothed(artifact_lvl_smoothed, t, timelimit_min_smoothed, timelimit_max_smoothed)
-        if result_smoothed is True:
+
+        if potentially_affected.artif_over_threshold_smoothed is True:
             affected_smoothed.append(potentially_affected)
         else:
             not_affected_smoothed.append(potentially_affected)
@@ -896,11 +845,13 @@ def plot_affected_channels(artif_affected_channels: list, artifact_lvl: float, t
             'xanchor': 'center',
             'yanchor': 'top'})
         
-    #in any case - add the threshold on the plot
-    fig.add_trace(go.Scatter(x=t, y=[(artifact_lvl)]*len(t), line=dict(color='red'), name='Thres=mean_peak/norm_lvl')) #add threshold level
+    #in any case - add the threshold on the plot. 
+    #Threshold is a horizontal line, so its 2 end points are enough - no need to send a value for every time point to the figure:
+    t_ends = [t[0], t[-1]]
+    fig.add_trace(go.Scatter(x=t_ends, y=[artifact_lvl, artifact_lvl], line=dict(color='red'), name='Thres=mean_peak/norm_lvl')) #add threshold level
 
     if flip_data is False and artifact_lvl is not None: 
-        fig.add_trace(go.Scatter(x=t, y=[(-artifact_lvl)]*len(t), line=dict(color='black'), name='-Thres=mean_peak/norm_lvl'))
+        fig.add_trace(go.Scatter(x=t_ends, y=[-artifact_lvl, -artifact_lvl], line=dict(color='black'), name='-Thres=mean_peak/norm_lvl'))
 
     if verbose_plots is True:
         fig.show()
@@ -945,35 +896,40 @@ def flip_channels(artif_per_ch_nonflipped: list, tmin: float, tmax: float, sfreq
     Returns
     -------
     artifacts_flipped : list
-        The list of the ecg epochs.
+        The list of the ecg epochs. This is the same list as the input, the Avg_artif objects in it are flipped in place.
     artif_time_vector : np.ndarray
         The time vector for the ecg epoch (for plotting further).
 
 
     """
 
-    artif_time_vector = np.round(np.arange(tmin, tmax+1/sfreq, 1/sfreq), 3) #yes, you need to round
+    #time vector built from integer sample indexes the same way mne builds epoch times: no float drift, so no rounding needed, 
+    #and the length always matches the epoch data (np.arange with float step can give one sample more or less):
+    first_sample = int(round(tmin*sfreq))
+    artif_time_vector = np.arange(first_sample, first_sample+len(artif_per_ch_nonflipped[0].artif_data)) / sfreq
 
     _, t0_estimated_ind, t0_estimated_ind_start, t0_estimated_ind_end = estimate_t0(artif_per_ch_nonflipped, artif_time_vector, params_internal)
 
-    artifacts_flipped=[]
-
-    for ch_artif in artif_per_ch_nonflipped: #for each channel:
+    #for each channel find the peak_loc which is located the closest to t0_estimated_ind (-1 if channel has no peaks):
+    n_ch = len(artif_per_ch_nonflipped)
+    peak_loc_closest_to_t0 = np.full(n_ch, -1, dtype=np.int64)
+    peak_val_closest_to_t0 = np.zeros(n_ch)
+    for i, ch_artif in enumerate(artif_per_ch_nonflipped):
+        if ch_artif.peak_loc.size>0:
+            peak_loc_closest_to_t0[i]=ch_artif.peak_loc[np.argmin(np.abs(ch_artif.peak_loc-t0_estimated_ind))]
+            peak_val_closest_to_t0[i]=ch_artif.artif_data[peak_loc_closest_to_t0[i]]
 
-        if ch_artif.peak_loc.size>0: #if there are any peaks - find peak_locs which is located the closest to t0_estimated_ind:
-            peak_loc_closest_to_t0=ch_artif.peak_loc[np.argmin(np.abs(ch_artif.peak_loc-t0_estimated_ind))]
+    #flip the data on all channels where peak_loc_closest_t0 is negative and is located in the estimated time window of the wave (one vectorized decision):
+    flip_mask = (peak_val_closest_to_t0<0) & (peak_loc_closest_to_t0>t0_estimated_ind_start) & (peak_loc_closest_to_t0<t0_estimated_ind_end)
 
-            #if peak_loc_closest_t0 is negative and is located in the estimated time window of the wave - flip the data:
-            if (ch_artif.artif_data[peak_loc_closest_to_t0]<0) & (peak_loc_closest_to_t0>t0_estimated_ind_start) & (peak_loc_closest_to_t0<t0_estimated_ind_end):
-                ch_artif.flip_artif()
-                if ch_artif.artif_data_smoothed is not None: #if there is also smoothed data present - flip it as well:
-                    ch_artif.flip_artif_smoothed()
-            else:
-                pass
-        else:
-            pass
+    #Avg_artif objects are flipped in place, so only the channels which need flipping are visited and no new list is built:
+    for i in np.flatnonzero(flip_mask):
+        ch_artif = artif_per_ch_nonflipped[i]
+        ch_artif.flip_artif()
+        if ch_artif.artif_data_smoothed is not None: #if there is also smoothed data present - flip it as well:
+            ch_artif.flip_artif_smoothed()
 
-        artifacts_flipped.append(ch_artif)
+    artifacts_flipped = artif_per_ch_nonflipped
 
     return artifacts_flipped, artif_time_vector
 
@@ -1023,19 +979,22 @@ def estimate_t0(artif_per_ch_nonflipped: list, t: np.ndarray, params_internal: d
     #collect artif data for each channel into nd array:
     avg_ecg_epoch_data_nonflipped = np.array([ch.artif_data for ch in artif_per_ch_nonflipped]) 
 
-    #find indexes of t where t is between timelimit_min and timelimit_max (limits where R wave typically is detected by mne):
-    t_event_ind=np.argwhere((t>timelimit_min) & (t<timelimit_max))
+    #find first and last indexes of t where t is between timelimit_min and timelimit_max (limits where R wave typically is detected by mne).
+    #t is sorted, so binary search is enough here:
+    t_event_ind_start=np.searchsorted(t, timelimit_min, side='right') #first index with t>timelimit_min
+    t_event_ind_end=np.searchsorted(t, timelimit_max, side='left')-1 #last index with t<timelimit_max
 
     # cut the data of each channel to the time interval where wave is expected to be:
-    avg_ecg_epoch_data_nonflipped_limited_to_event=avg_ecg_epoch_data_nonflipped[:,t_event_ind[0][0]:t_event_ind[-1][0]]
+    avg_ecg_epoch_data_nonflipped_limited_to_event=avg_ecg_epoch_data_nonflipped[:,t_event_ind_start:t_event_ind_end]
 
-    #find 5 channels with max values in the time interval where wave is expected to be:
-    max_values=np.max(np.abs(avg_ecg_epoch_data_nonflipped_limited_to_event), axis=1)
-    max_values_ind=np.argsort(max_values)[::-1]
-    max_values_ind=max_values_ind[:5]
+    #find 5 channels with max values in the time interval where wave is expected to be (order among these 5 doesnt matter, so no full sort needed):
+    abs_data_limited_to_event=np.abs(avg_ecg_epoch_data_nonflipped_limited_to_event) #computed once, used for both max values and their locations
+    max_values=np.max(abs_data_limited_to_event, axis=1)
+    n_top=min(5, len(max_values))
+    max_values_ind=np.argpartition(max_values, -n_top)[-n_top:]
 
     # find the index of max value for each of these 5 channels:
-    max_values_ind_in_avg_ecg_epoch_data_nonflipped=np.argmax(np.abs(avg_ecg_epoch_data_nonflipped_limited_to_event[max_values_ind]), axis=1)
+    max_values_ind_in_avg_ecg_epoch_data_nonflipped=np.argmax(abs_data_limited_to_event[max_values_ind], axis=1)
     
     #find average index of max value for these 5 channels, then derive t0_estimated:
     t0_estimated_average=int(np.round(np.mean(max_values_ind_in_avg_ecg_epoch_data_nonflipped)))
@@ -1043,19 +1002,15 @@ def estimate_t0(artif_per_ch_nonflipped: list, t: np.ndarray, params_internal: d
     #Now need to get back to actual time interval of the whole epoch:
 
     #find t0_estimated to use as the point where peak of each ch data should be:
-    t0_estimated_ind=t_event_ind[0][0]+t0_estimated_average #sum because time window was cut from the beginning of the epoch previously
+    t0_estimated_ind=t_event_ind_start+t0_estimated_average #sum because time window was cut from the beginning of the epoch previously
     t0_estimated=t[t0_estimated_ind]
 
     # window of 0.015 or 0.05s around t0_estimated where the peak on different channels should be detected:
-    t0_estimated_ind_start=np.argwhere(t==round(t0_estimated-window_size_for_mean_threshold_method, 3))[0][0] 
-    t0_estimated_ind_end=np.argwhere(t==round(t0_estimated+window_size_for_mean_threshold_method, 3))[0][0]
-    #yes you have to round it here because the numbers stored in in memery like 0.010000003 even when it looks like 0.01, hence np.where cant find the target float in t vector
-
-
-    #another way without round would be to find the closest index of t to t0_estimated-0.015:
-    #t0_estimated_ind_start=np.argwhere(t==np.min(t[t<t0_estimated-window_size]))[0][0]
-    # find the closest index of t to t0_estimated+0.015:
-    #t0_estimated_ind_end=np.argwhere(t==np.min(t[t>t0_estimated+window_size]))[0][0]
+    #t is sorted, so find the sample closest to each window border by binary search. 
+    #Shifting the target by half a sample makes it robust to float representation (0.010000003 vs 0.01), no rounding needed:
+    half_step=(t[-1]-t[0])/(len(t)-1)/2 #average step, t may be rounded
+    t0_estimated_ind_start=int(np.searchsorted(t, t0_estimated-window_size_for_mean_threshold_method-half_step))
+    t0_estimated_ind_end=min(int(np.searchsorted(t, t0_estimated+window_size_for_mean_threshold_method-half_step)), len(t)-1)
     
     return t0_estimated, t0_estimated_ind, t0_estimated_ind_start, t0_estimated_ind_end
 
@@ -1092,6 +1047,9 @@ def calculate_artifacts_on_channels(artif_epochs: mne.Epochs, channels: list, ch
     -------
     all_artifs_nonflipped : list
         List of channels with Avg_artif objects, data in these is not flipped yet.
+    avg_artif_data : np.ndarray
+        Average artifact epochs of all channels, shape (n_channels, n_times). 
+        artif_data of the Avg_artif objects are views of its rows, so in place flips of the objects are also seen here.
         
     """
 
@@ -1110,20 +1068,27 @@ def calculate_artifacts_on_channels(artif_epochs: mne.Epochs, channels: list, ch
     # 2. take 5 channels with most prominent peak 
     # 3. find estimated average t0 for all 5 channels, because t0 of event which mne estimated is often not accurate
 
-    avg_artif_data_nonflipped=avg_epochs.data #shape (n_channels, n_times)
+    avg_artif_data_nonflipped=np.ascontiguousarray(avg_epochs.data, dtype=np.float32) #shape (n_channels, n_times). float32 is plenty for MEG magnitudes and halves memory traffic in all steps below
+
+    # smooth all channels at once along the time axis (same result as smoothing every channel separately in smooth_artif()):
+    avg_artif_data_smoothed=gaussian_filter1d(avg_artif_data_nonflipped, gaussian_sigma, axis=1)
+
+    # prominence thresholds for peakfinder for all channels at once (one reduction along time axis instead of one per channel):
+    thresh_mean_all=np.ptp(avg_artif_data_nonflipped, axis=1) / thresh_lvl_peakfinder
+    thresh_mean_all_smoothed=np.ptp(avg_artif_data_smoothed, axis=1) / thresh_lvl_peakfinder
 
     # 4. detect peaks on channels 
     all_artifs_nonflipped = []
     for i, ch_data in enumerate(avg_artif_data_nonflipped):  # find peaks and estimate detect wave shape on all channels
-        artif_nonflipped = Avg_artif(name=channels[i], artif_data=ch_data)
-        artif_nonflipped.get_peaks_wave(max_n_peaks_allowed=max_n_peaks_allowed, thresh_lvl_peakfinder=thresh_lvl_peakfinder)
-        artif_nonflipped.get_peaks_wave_smoothed(gaussian_sigma = gaussian_sigma, max_n_peaks_allowed=max_n_peaks_allowed, thresh_lvl_peakfinder=thresh_lvl_peakfinder)
+        artif_nonflipped = Avg_artif(name=channels[i], artif_data=ch_data, artif_data_smoothed=avg_artif_data_smoothed[i])
+        artif_nonflipped.get_peaks_wave(max_n_peaks_allowed=max_n_peaks_allowed, thresh_lvl_peakfinder=thresh_lvl_peakfinder, thresh_mean=thresh_mean_all[i])
+        artif_nonflipped.get_peaks_wave_smoothed(gaussian_sigma = gaussian_sigma, max_n_peaks_allowed=max_n_peaks_allowed, thresh_lvl_peakfinder=thresh_lvl_peakfinder, thresh_mean=thresh_mean_all_smoothed[i])
         all_artifs_nonflipped.append(artif_nonflipped)
 
     # assign lobe to each channel right away (for plotting)
     all_artifs_nonflipped = assign_lobe_to_artifacts(all_artifs_nonflipped, chs_by_lobe)
 
-    return all_artifs_nonflipped
+    return all_artifs_nonflipped, avg_artif_data_nonflipped
 
 
 def find_mean_rwave_blink(ch_data: np.ndarray or list, event_indexes: np.ndarray, tmin: float, tmax: float, sfreq: int):
@@ -1277,7 +1242,8 @@ def find_affected_by_correlation(mean_rwave: np.ndarray, artif_per_ch: list):
         return
 
     for ch in artif_per_ch:
-        ch.corr_coef, ch.p_value = pearsonr(ch.artif_data_smoothed, mean_rwave)
+        corr_coef, p_value = pearsonr(ch.artif_data_smoothed, mean_rwave)
+        ch.corr_coef, ch.p_value = float(corr_coef), float(p_value) #plain floats: they go into the json output, numpy float32 is not serializable
     
     return artif_per_ch
 
@@ -1307,16 +1273,12 @@ def plot_correlation(artif_per_ch, ecg_or_eog, m_or_g, verbose_plots=False):
 
     _, _, _, corr_val_of_last_most_correlated, corr_val_of_last_middle_correlated, corr_val_of_last_least_correlated = split_correlated_artifacts_into_3_groups(artif_per_ch)
 
-    print('least', corr_val_of_last_least_correlated)
-    print('middle', corr_val_of_last_middle_correlated)
-    print('most', corr_val_of_last_most_correlated)
-
     traces = []
 
     tit, _ = get_tit_and_unit(m_or_g)
 
     for ch in artif_per_ch:
-        traces += [go.Scatter(x=[abs(ch.corr_coef)], y=[ch.p_value], mode='markers', marker=dict(size=5, color=ch.color), name=ch.name, legendgroup=ch.lobe, legendgrouptitle=dict(text=ch.lobe.upper()), hovertemplate='Corr coef: '+str(ch.corr_coef)+'<br>p-value: '+str(abs(ch.p_value)))]
+        traces.append(go.Scatter(x=[abs(ch.corr_coef)], y=[ch.p_value], mode='markers', marker=dict(size=5, color=ch.color), name=ch.name, legendgroup=ch.lobe, legendgrouptitle=dict(text=ch.lobe.upper()), hovertemplate='Corr coef: '+str(ch.corr_coef)+'<br>p-value: '+str(abs(ch.p_value))))
 
     fig = go.Figure(data=traces)
 
@@ -1480,15 +1442,15 @@ def plot_artif_per_ch_correlated_lobes(artif_per_ch: list, tmin: float, tmax: fl
         fig_least_affected.show()
     
     affected_derivs = []
-    affected_derivs += [QC_derivative(fig_most_affected, ecg_or_eog+'most_affected_channels_'+m_or_g, 'plotly')]
-    affected_derivs += [QC_derivative(fig_middle_affected, ecg_or_eog+'middle_affected_channels_'+m_or_g, 'plotly')]
-    affected_derivs += [QC_derivative(fig_least_affected, ecg_or_eog+'least_affected_channels_'+m_or_g, 'plotly')]
+    affected_derivs.append(QC_derivative(fig_most_affected, ecg_or_eog+'most_affected_channels_'+m_or_g, 'plotly'))
+    affected_derivs.append(QC_derivative(fig_middle_affected, ecg_or_eog+'middle_affected_channels_'+m_or_g, 'plotly'))
+    affected_derivs.append(QC_derivative(fig_least_affected, ecg_or_eog+'least_affected_channels_'+m_or_g, 'plotly'))
         
     return affected_derivs
 
 
 
-def find_affected_over_mean(artif_per_ch: list, ecg_or_eog: str, params_internal: dict, thresh_lvl_peakfinder: float, plotflag: bool, verbose_plots: bool, m_or_g: str, chs_by_lobe: dict, norm_lvl: float, flip_data: bool, gaussian_sigma: float, artif_time_vector: np.ndarray):
+def find_affected_over_mean(artif_per_ch: list, ecg_or_eog: str, params_internal: dict, thresh_lvl_peakfinder: float, plotflag: bool, verbose_plots: bool, m_or_g: str, chs_by_lobe: dict, norm_lvl: float, flip_data: bool, gaussian_sigma: float, artif_time_vector: np.ndarray, artif_data_all: np.ndarray = None):
     
     """
     1. Calculate average ECG epoch on the epochs from all channels. Check if average has a wave shape. 
@@ -1537,6 +1499,9 @@ def find_affected_over_mean(artif_per_ch: list, ecg_or_eog: str, params_internal
         sigma for gaussian smoothing
     artif_time_vector : np.ndarray
         time vector for the artifact epoch
+    artif_data_all : np.ndarray, optional
+        (already flipped) artifact data of all channels as one array of shape (n_channels, n_times), as returned by calculate_artifacts_on_channels().
+        If None - the data is collected from artif_per_ch. The default is None.
 
     Returns
     -------
@@ -1554,8 +1519,10 @@ def find_affected_over_mean(artif_per_ch: list, ecg_or_eog: str, params_internal
     max_n_peaks_allowed_for_avg = params_internal['max_n_peaks_allowed_for_avg']
     window_size_for_mean_threshold_method = params_internal['window_size_for_mean_threshold_method']
 
-    artif_per_ch_only_data = [ch.artif_data for ch in artif_per_ch] # USE NON SMOOTHED data. If needed, can be changed to smoothed data
-    avg_overall=np.mean(artif_per_ch_only_data, axis=0) 
+    # USE NON SMOOTHED data. If needed, can be changed to smoothed data
+    if artif_data_all is None:
+        artif_data_all = np.array([ch.artif_data for ch in artif_per_ch])
+    avg_overall=np.mean(artif_data_all, axis=0) #reduce the same buffer the channels were flipped in, no new stack of all channels
     # will show if there is ecg artifact present  on average. should have wave shape if yes. 
     # otherwise - it was not picked up/reconstructed correctly
 
@@ -1570,14 +1537,16 @@ def find_affected_over_mean(artif_per_ch: list, ecg_or_eog: str, params_internal
 
     if avg_overall_obj.wave_shape is True or avg_overall_obj.wave_shape_smoothed is True: #if the average ecg artifact is good - do steps 2 and 3:
 
-        mean_magnitude_peak=np.max(avg_overall_obj.peak_magnitude)
-        mean_ecg_loc_peak = avg_overall_obj.peak_loc[np.argmax(avg_overall_obj.peak_magnitude)]
+        highest_peak_ind = np.argmax(avg_overall_obj.peak_magnitude) #one reduction gives both the magnitude and the location of the highest peak
+        mean_magnitude_peak=avg_overall_obj.peak_magnitude[highest_peak_ind]
+        mean_ecg_loc_peak = avg_overall_obj.peak_loc[highest_peak_ind]
         t0_actual=artif_time_vector[mean_ecg_loc_peak]
         #set t0_actual as the time of the peak of the average ecg artifact
         
         if avg_overall_obj.wave_shape_smoothed is not None: #if smoothed average and its peaks were also calculated:
-            mean_magnitude_peak_smoothed=np.max(avg_overall_obj.peak_magnitude_smoothed)
-            mean_ecg_loc_peak_smoothed = avg_overall_obj.peak_loc_smoothed[np.argmax(avg_overall_obj.peak_magnitude_smoothed)]
+            highest_peak_ind_smoothed = np.argmax(avg_overall_obj.peak_magnitude_smoothed)
+            mean_magnitude_peak_smoothed=avg_overall_obj.peak_magnitude_smoothed[highest_peak_ind_smoothed]
+            mean_ecg_loc_peak_smoothed = avg_overall_obj.peak_loc_smoothed[highest_peak_ind_smoothed]
             t0_actual_smoothed=artif_time_vector[mean_ecg_loc_peak_smoothed]
         else:
             mean_magnitude_peak_smoothed=None
@@ -1612,10 +1581,10 @@ def find_affected_over_mean(artif_per_ch: list, ecg_or_eog: str, params_internal
             fig_not_affected = plot_affected_channels(not_affected_channels, artifact_lvl, artif_time_vector, ch_type=m_or_g, fig_tit=ecg_or_eog+' not affected channels (orig): ', chs_by_lobe=chs_by_lobe, flip_data=flip_data, smoothed = False, verbose_plots=verbose_plots)
             fig_not_affected_smoothed = plot_affected_channels(not_affected_channels_smoothed, artifact_lvl_smoothed, artif_time_vector, ch_type=m_or_g, fig_tit=ecg_or_eog+' not affected channels (smoothed): ', chs_by_lobe=chs_by_lobe, flip_data=flip_data, smoothed = True, verbose_plots=verbose_plots)
             
-            affected_derivs += [QC_derivative(fig_affected, ecg_or_eog+'_affected_channels_'+m_or_g, 'plotly')]
-            affected_derivs += [QC_derivative(fig_not_affected, ecg_or_eog+'_not_affected_channels_smooth'+m_or_g, 'plotly')]
-            affected_derivs += [QC_derivative(fig_affected_smoothed, ecg_or_eog+'_affected_channels_'+m_or_g, 'plotly')]
-            affected_derivs += [QC_derivative(fig_not_affected_smoothed, ecg_or_eog+'_not_affected_channels_smooth'+m_or_g, 'plotly')]
+            affected_derivs.append(QC_derivative(fig_affected, ecg_or_eog+'_affected_channels_'+m_or_g, 'plotly'))
+            affected_derivs.append(QC_derivative(fig_not_affected, ecg_or_eog+'_not_affected_channels_smooth'+m_or_g, 'plotly'))
+            affected_derivs.append(QC_derivative(fig_affected_smoothed, ecg_or_eog+'_affected_channels_'+m_or_g, 'plotly'))
+            affected_derivs.append(QC_derivative(fig_not_affected_smoothed, ecg_or_eog+'_not_affected_channels_smooth'+m_or_g, 'plotly'))
 
     else: #if the average artifact is bad - end processing
         tit, _ = get_tit_and_unit(m_or_g)
@@ -1660,14 +1629,16 @@ def make_dict_global_ECG_EOG(channels_ranked: list, use_method: str):
     # sort all_affected_channels by main_peak_magnitude:
     if use_method == 'mean_threshold':
         if channels_ranked:
-            all_affected_channels_sorted = sorted(channels_ranked, key=lambda ch: ch.main_peak_magnitude, reverse=True)
-            affected_chs = {ch.name: ch.main_peak_magnitude for ch in all_affected_channels_sorted}
+            mags = np.fromiter((ch.main_peak_magnitude for ch in channels_ranked), dtype=np.float64, count=len(channels_ranked))
+            order = np.argsort(-mags, kind='stable') #descending, ties keep their original order (same as sorted(..., reverse=True))
+            affected_chs = {channels_ranked[i].name: channels_ranked[i].main_peak_magnitude for i in order}
             metric_global_content = {'details':  affected_chs}
         else:
             metric_global_content = {'details':  None}
     elif use_method == 'correlation' or use_method == 'correlation_reconstructed':
-        all_affected_channels_sorted = sorted(channels_ranked, key=lambda ch: abs(ch.corr_coef), reverse=True)
-        affected_chs = {ch.name: [ch.corr_coef, ch.p_value] for ch in all_affected_channels_sorted}
+        abs_corr = np.fromiter((abs(ch.corr_coef) for ch in channels_ranked), dtype=np.float64, count=len(channels_ranked))
+        order = np.argsort(-abs_corr, kind='stable')
+        affected_chs = {channels_ranked[i].name: [channels_ranked[i].corr_coef, channels_ranked[i].p_value] for i in order}
         metric_global_content = {'details':  affected_chs}
     else:
         raise ValueError('Unknown method_used: ', use_method)
@@ -1756,7 +1727,7 @@ def plot_ecg_eog_mne(ecg_epochs: mne.Epochs, m_or_g: str, tmin: float, tmax: flo
     fig_ecg = ecg_epochs.plot_image(combine='mean', picks = m_or_g)[0] #plot averageg over ecg epochs artifact
     # [0] is to plot only 1 figure. the function by default is trying to plot both mag and grad, but here we want 
     # to do them saparetely depending on what was chosen for analysis
-    mne_ecg_derivs += [QC_derivative(fig_ecg, 'mean_ECG_epoch_'+m_or_g, 'matplotlib')]
+    mne_ecg_derivs.append(QC_derivative(fig_ecg, 'mean_ECG_epoch_'+m_or_g, 'matplotlib'))
 
     #averaging the ECG epochs together:
     avg_ecg_epochs = ecg_epochs.average() #.apply_baseline((-0.5, -0.2))
@@ -1767,7 +1738,7 @@ def plot_ecg_eog_mne(ecg_epochs: mne.Epochs, m_or_g: str, tmin: float, tmax: flo
     # tmin+tmin/10 and tmax-tmax/10 is done because mne sometimes has a plotting issue, probably connected tosamplig rate: 
     # for example tmin is  set to -0.05 to 0.02, but it  can only plot between -0.0496 and 0.02.
 
-    mne_ecg_derivs += [QC_derivative(fig_ecg_sensors, 'ECG_field_pattern_sensors_'+m_or_g, 'matplotlib')]
+    mne_ecg_derivs.append(QC_derivative(fig_ecg_sensors, 'ECG_field_pattern_sensors_'+m_or_g, 'matplotlib'))
 
     return mne_ecg_derivs
 
@@ -1799,7 +1770,7 @@ def get_ECG_data_choose_method(raw: mne.io.Raw, ecg_params: dict, verbose_plots:
     ecg_str : str
         String with info about the ECG channel presense.
     noisy_ch_derivs : list
-        List of QC_derivative objects with plot of the ECG channel
+        List of QC_derivative objects with plot of the ECG channel. Empty if verbose_plots is False.
     ecg_data:
         ECG channel data.
     event_indexes:
@@ -1820,8 +1791,13 @@ def get_ECG_data_choose_method(raw: mne.io.Raw, ecg_params: dict, verbose_plots:
 
         bad_ecg_eog, ecg_data, event_indexes, ecg_eval = detect_noisy_ecg(raw, ecg_ch,  ecg_or_eog = 'ECG', n_breaks_bursts_allowed_per_10min = ecg_params['n_breaks_bursts_allowed_per_10min'], allowed_range_of_peaks_stds = ecg_params['allowed_range_of_peaks_stds'], height_multiplier = ecg_params['height_multiplier'])
 
-        fig = plot_ECG_EOG_channel(ecg_data, event_indexes, ch_name = ecg_ch, fs = raw.info['sfreq'], verbose_plots = verbose_plots)
-        noisy_ch_derivs = [QC_derivative(fig, bad_ecg_eog[ecg_ch]+' '+ecg_ch, 'plotly', description_for_user = ecg_ch+' is '+ bad_ecg_eog[ecg_ch]+ ': 1) peaks have similar amplitude: '+str(ecg_eval[0])+', 2) tolerable number of breaks: '+str(ecg_eval[1])+', 3) tolerable number of bursts: '+str(ecg_eval[2]))]
+        #Plot of the whole raw ECG channel is expensive to build and is currently not added to the report, 
+        #so only build it when it is going to be shown:
+        if verbose_plots is True:
+            fig = plot_ECG_EOG_channel(ecg_data, event_indexes, ch_name = ecg_ch, fs = raw.info['sfreq'], verbose_plots = verbose_plots)
+            noisy_ch_derivs = [QC_derivative(fig, bad_ecg_eog[ecg_ch]+' '+ecg_ch, 'plotly', description_for_user = ecg_ch+' is '+ bad_ecg_eog[ecg_ch]+ ': 1) peaks have similar amplitude: '+str(ecg_eval[0])+', 2) tolerable number of breaks: '+str(ecg_eval[1])+', 3) tolerable number of bursts: '+str(ecg_eval[2]))]
+        else:
+            noisy_ch_derivs = []
 
         if bad_ecg_eog[ecg_ch] == 'bad': #ecg channel present but noisy:
             ecg_str = 'ECG channel data is too noisy, cardio artifacts were reconstructed. ECG channel was dropped from the analysis. Consider checking the quality of ECG channel on your recording device. '
@@ -1890,8 +1866,9 @@ def get_EOG_data(raw: mne.io.Raw):
         print('___MEG QC___: ', eog_str)
         return eog_str, noisy_ch_derivs, eog_data, event_indexes
 
-    # Get the data of the EOG channel as an array. MNE only sees blinks, not saccades.
-    eog_data = raw.get_data(picks=eog_channel_names)
+    # Get the data of all EOG channels as one array. MNE only sees blinks, not saccades.
+    # Integer picks are used directly, no need to resolve the names again.
+    eog_data = raw.get_data(picks=eog_channels)
 
     eog_str = ', '.join(eog_channel_names)+' used to identify eye blinks. '
 
@@ -1901,7 +1878,7 @@ def get_EOG_data(raw: mne.io.Raw):
     event_indexes_all = []
     for ch in eog_data:
         event_indexes, _ = find_peaks(ch, height=height, distance=round(0.5 * fs)) #assume there are no peaks within 0.5 seconds from each other.
-        event_indexes_all += [event_indexes.tolist()]
+        event_indexes_all.append(event_indexes) #keep as array, find_mean_rwave_blink() only iterates over it
 
     return eog_str, eog_data, event_indexes_all, eog_channel_names
 
@@ -2019,7 +1996,7 @@ def find_t0_mean(ch_data: np.ndarray or list):
     """
 
     
-    prominence=(max(ch_data) - min(ch_data)) / 8
+    prominence=np.ptp(ch_data) / 8
     #run peak detection:
     peaks_pos_loc, _ = find_peaks(ch_data, prominence=prominence)
     peaks_neg_loc, _ = find_peaks(-ch_data, prominence=prominence)
@@ -2056,7 +2033,7 @@ def find_t0_highest(ch_data: np.ndarray):
         t0 for the channel (index, not the seconds!).
     """
     
-    prominence=(max(ch_data) - min(ch_data)) / 8
+    prominence=np.ptp(ch_data) / 8
     #run peak detection:
     peaks_pos_loc, _ = find_peaks(ch_data, prominence=prominence)
     if len(peaks_pos_loc) == 0:
@@ -2266,15 +2243,8 @@ def align_mean_rwave(mean_rwave: np.ndarray, artif_per_ch: list, tmin: float, tm
     """
 
     t0_channels = find_t0_channels(artif_per_ch, tmin, tmax)
-
-    t = np.linspace(tmin, tmax, len(mean_rwave))
-    t0_time_channels = t[t0_channels]
     
     t0_mean = find_t0_mean(mean_rwave)
-    t0_time_mean = t[t0_mean]
-
-    print('t0_time_channels: ', t0_time_channels)
-    print('t0_time_mean: ', t0_time_mean)
 
     mean_rwave_shifted_variations = []
     for t0_m in t0_mean:
@@ -2358,13 +2328,18 @@ def ECG_meg_qc(ecg_params: dict, ecg_params_internal: dict, raw: mne.io.Raw, cha
     bad_avg_str = {}
     avg_objects_ecg =[]
 
-    for m_or_g  in m_or_g_chosen:
+    #ECG events are the same for mags and grads: detect them only once (same settings as mne.preprocessing.create_ecg_epochs uses inside)
+    #and only average them separately for each channel type:
+    ecg_events, _, _ = mne.preprocessing.find_ecg_events(raw, event_id=999, l_freq=8, h_freq=16, reject_by_annotation=True)
+
+    #cut and load the epochs once for all chosen channel types. No amplitude rejection is used, so the same epochs are kept as when cutting them per type:
+    ecg_epochs = mne.Epochs(raw, events=ecg_events, event_id=999, tmin=tmin, tmax=tmax, proj=False, baseline=None, reject_by_annotation=True, picks=[ch for m_or_g in m_or_g_chosen for ch in channels[m_or_g]], preload=True)
 
-        ecg_epochs = mne.preprocessing.create_ecg_epochs(raw, picks=channels[m_or_g], tmin=tmin, tmax=tmax)
+    for m_or_g  in m_or_g_chosen:
 
         # ecg_derivs += plot_ecg_eog_mne(ecg_epochs, m_or_g, tmin, tmax)
 
-        artif_per_ch = calculate_artifacts_on_channels(ecg_epochs, channels[m_or_g], chs_by_lobe=chs_by_lobe[m_or_g], thresh_lvl_peakfinder=thresh_lvl_peakfinder, tmin=tmin, tmax=tmax, params_internal=ecg_params_internal, gaussian_sigma=gaussian_sigma)
+        artif_per_ch, artif_data_all = calculate_artifacts_on_channels(ecg_epochs, channels[m_or_g], chs_by_lobe=chs_by_lobe[m_or_g], thresh_lvl_peakfinder=thresh_lvl_peakfinder, tmin=tmin, tmax=tmax, params_internal=ecg_params_internal, gaussian_sigma=gaussian_sigma)
 
         #use_method = 'mean_threshold' 
 
@@ -2374,7 +2349,7 @@ def ECG_meg_qc(ecg_params: dict, ecg_params_internal: dict, raw: mne.io.Raw, cha
 
         if use_method == 'mean_threshold':
             artif_per_ch, artif_time_vector = flip_channels(artif_per_ch, tmin, tmax, sfreq, ecg_params_internal)
-            affected_channels[m_or_g], affected_derivs, bad_avg_str[m_or_g], avg_overall_obj = find_affected_over_mean(artif_per_ch, 'ECG', ecg_params_internal, thresh_lvl_peakfinder, plotflag=True, verbose_plots=verbose_plots, m_or_g=m_or_g, chs_by_lobe=chs_by_lobe[m_or_g], norm_lvl=norm_lvl, flip_data=True, gaussian_sigma=gaussian_sigma, artif_time_vector=artif_time_vector)
+            affected_channels[m_or_g], affected_derivs, bad_avg_str[m_or_g], avg_overall_obj = find_affected_over_mean(artif_per_ch, 'ECG', ecg_params_internal, thresh_lvl_peakfinder, plotflag=True, verbose_plots=verbose_plots, m_or_g=m_or_g, chs_by_lobe=chs_by_lobe[m_or_g], norm_lvl=norm_lvl, flip_data=True, gaussian_sigma=gaussian_sigma, artif_time_vector=artif_time_vector, artif_data_all=artif_data_all)
             correlation_derivs = []
 
         elif use_method == 'correlation' or use_method == 'correlation_reconstructed':
@@ -2385,12 +2360,13 @@ def ECG_meg_qc(ecg_params: dict, ecg_params_internal: dict, raw: mne.io.Raw, cha
             for mean_shifted in mean_rwave_shifted_variations:
                 affected_channels[m_or_g] = find_affected_by_correlation(mean_shifted, artif_per_ch)
                 #collect all correlation values for all channels:
-                all_corr_values = [abs(ch.corr_coef) for ch in affected_channels[m_or_g]]
-                #get 10 highest correlations:
-                all_corr_values.sort(reverse=True)
-                print('all_corr_values', all_corr_values)
-                all_corr_values = all_corr_values[:10]
-                mean_corr = np.mean(all_corr_values)
+                all_corr_values = np.fromiter((abs(ch.corr_coef) for ch in affected_channels[m_or_g]), dtype=np.float64, count=len(affected_channels[m_or_g]))
+                #get 10 highest correlations (only their mean is needed, so partition instead of sorting all channels):
+                n_top = min(10, len(all_corr_values))
+                if n_top == 0:
+                    mean_corr = np.nan #no channels: same as the mean of an empty list, this shift is never chosen as the best one
+                else:
+                    mean_corr = np.mean(np.partition(all_corr_values, -n_top)[-n_top:])
                 #if mean corr is better than the previous one - save it
 
                 best_mean_shifted = mean_shifted #preassign
@@ -2508,14 +2484,19 @@ def EOG_meg_qc(eog_params: dict, eog_params_internal: dict, raw: mne.io.Raw, cha
     affected_channels={}
     bad_avg_str = {}
     avg_objects_eog=[]
+
+    #EOG events are the same for mags and grads: detect them only once (same settings as mne.preprocessing.create_eog_epochs uses inside)
+    #and only average them separately for each channel type:
+    eog_events = mne.preprocessing.find_eog_events(raw, event_id=998, l_freq=1, h_freq=10, reject_by_annotation=True) #find_eog_events defaults to False, create_eog_epochs passes True
     
-    for m_or_g  in m_or_g_chosen:
+    #cut and load the epochs once for all chosen channel types. No amplitude rejection is used, so the same epochs are kept as when cutting them per type:
+    eog_epochs = mne.Epochs(raw, events=eog_events, event_id=998, tmin=tmin, tmax=tmax, proj=False, baseline=None, reject_by_annotation=True, picks=[ch for m_or_g in m_or_g_chosen for ch in channels[m_or_g]], preload=True)
 
-        eog_epochs = mne.preprocessing.create_eog_epochs(raw, picks=channels[m_or_g], tmin=tmin, tmax=tmax)
+    for m_or_g  in m_or_g_chosen:
 
         # eog_derivs += plot_ecg_eog_mne(eog_epochs, m_or_g, tmin, tmax)
 
-        artif_per_ch = calculate_artifacts_on_channels(eog_epochs, channels[m_or_g], chs_by_lobe=chs_by_lobe[m_or_g], thresh_lvl_peakfinder=thresh_lvl_peakfinder, tmin=tmin, tmax=tmax, params_internal=eog_params_internal, gaussian_sigma=gaussian_sigma)
+        artif_per_ch, artif_data_all = calculate_artifacts_on_channels(eog_epochs, channels[m_or_g], chs_by_lobe=chs_by_lobe[m_or_g], thresh_lvl_peakfinder=thresh_lvl_peakfinder, tmin=tmin, tmax=tmax, params_internal=eog_params_internal, gaussian_sigma=gaussian_sigma)
 
         #2 options:
         #1. find channels with peaks above threshold defined by average over all channels+multiplier set by user
@@ -2523,7 +2504,7 @@ def EOG_meg_qc(eog_params: dict, eog_params_internal: dict, raw: mne.io.Raw, cha
 
         if use_method == 'mean_threshold':
             artif_per_ch, artif_time_vector = flip_channels(artif_per_ch, tmin, tmax, sfreq, eog_params_internal)
-            affected_channels[m_or_g], affected_derivs, bad_avg_str[m_or_g], avg_overall_obj = find_affected_over_mean(artif_per_ch, 'EOG', eog_params_internal, thresh_lvl_peakfinder, plotflag=True, verbose_plots=verbose_plots, m_or_g=m_or_g, chs_by_lobe=chs_by_lobe[m_or_g], norm_lvl=norm_lvl, flip_data=True, gaussian_sigma=gaussian_sigma, artif_time_vector=artif_time_vector)
+            affected_channels[m_or_g], affected_derivs, bad_avg_str[m_or_g], avg_overall_obj = find_affected_over_mean(artif_per_ch, 'EOG', eog_params_internal, thresh_lvl_peakfinder, plotflag=True, verbose_plots=verbose_plots, m_or_g=m_or_g, chs_by_lobe=chs_by_lobe[m_or_g], norm_lvl=norm_lvl, flip_data=True, gaussian_sigma=gaussian_sigma, artif_time_vector=artif_time_vector, artif_data_all=artif_data_all)
             correlation_derivs = []
 
         elif use_method == 'correlation' or use_method == 'correlation_reconstructed':
@@ -7,6 +7,7 @@ from mne.preprocessing import annotate_movement, compute_average_dev_head_t
 import time
 from meg_qc.source.universal_plots import QC_derivative
 import matplotlib #this is in case we will need to suppress mne matplotlib plots
+import matplotlib.pyplot as plt
 
 mne.viz.set_browser_backend('matplotlib')
 
@@ -165,6 +166,8 @@ def make_head_pos_plot(raw: mne.io.Raw, head_pos: np.ndarray, verbose_plots: boo
 
 
     head_derivs += [QC_derivative(fig1, 'Head_position_rotation_average_mne', 'matplotlib', description_for_user = 'The green horizontal lines - original head position. Red lines - the new head position averaged over all the time points.')]
+    if verbose_plots is False:
+        plt.close(fig1) #not shown, QC_derivative keeps it for the report
 
 
     #plot head_pos using PLOTLY:
@@ -115,8 +115,7 @@ def Plot_psd(m_or_g:str, freqs: np.ndarray, psds:np.ndarray, channels: list, chs
 
     df_psds=pd.DataFrame(psds.T, columns=channels)
 
-    # Assuming df_psds is a DataFrame with a DateTimeIndex
-    downsampling_factor = 5  # replace with your desired downsampling factor
+    downsampling_factor = 5 #plot every 5th frequency to keep the html report small
     df_psds_downsampled = df_psds[::downsampling_factor]
     fig = plot_df_of_channels_data_as_lines_by_lobe(chs_by_lobe, df_psds_downsampled, freqs)
 
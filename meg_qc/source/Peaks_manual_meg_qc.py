@@ -48,38 +48,29 @@ def neighbour_peak_amplitude(max_pair_dist_sec: float, sfreq: int, pos_peak_locs
         return 0, None
     
     pair_dist=max_pair_dist_sec*sfreq
-    pairs_magnitudes=[]
-    pairs_locs=[]
 
-    # Looping over all positive peaks
-    for posit_peak_ind, posit_peak_loc in enumerate(pos_peak_locs):
-        
-        # Finding the value in neg_peak_locs which is closest to posit_peak_loc
-        closest_negative_peak_index = np.abs(neg_peak_locs - posit_peak_loc).argmin()
+    # For all positive peaks at once: find the value in neg_peak_locs which is closest to posit_peak_loc.
+    # Peak locations from find_peaks are sorted, so the closest negative peak is one of the 2 neighbours found by binary search:
+    # the last one before the positive peak (left) or the first one at/after it (right).
+    right_ind = np.searchsorted(neg_peak_locs, pos_peak_locs)
+    left_ind = np.clip(right_ind-1, 0, len(neg_peak_locs)-1)
+    right_ind = np.clip(right_ind, 0, len(neg_peak_locs)-1)
+    dist_left = np.abs(neg_peak_locs[left_ind] - pos_peak_locs)
+    dist_right = np.abs(neg_peak_locs[right_ind] - pos_peak_locs)
+    closest_negative_peak_index = np.where(dist_left <= dist_right, left_ind, right_ind) #on equal distance take the left one, as argmin() did
 
-        # Check if the closest negative peak is within the given distance
-        if np.abs(neg_peak_locs[closest_negative_peak_index] - posit_peak_loc) <= pair_dist / 2:
-            pairs_locs.append([pos_peak_locs[posit_peak_ind], neg_peak_locs[closest_negative_peak_index]])
-            pairs_magnitudes.append([pos_peak_magnitudes[posit_peak_ind], neg_peak_magnitudes[closest_negative_peak_index]])
-        
-        # print("||:", neg_peak_ind)
-        # if neg_peak_ind[0].size != 0:
-        #     print("||: A")
-        #     #find the negative peak  which is located at a half of pair_dist from positive peak -> they will for a pair
-        #     pairs_locs.append([pos_peak_locs[posit_peak_ind], neg_peak_locs[neg_peak_ind[0][0]]])
-        #     pairs_magnitudes.append([pos_peak_magnitudes[posit_peak_ind], neg_peak_magnitudes[neg_peak_ind[0][0]]])
+    # Check if the closest negative peak is within the given distance
+    paired = np.minimum(dist_left, dist_right) <= pair_dist / 2
 
     # if no positive+negative pairs were fould (no corresponding peaks at given distamce to each other) -> 
     # peak amplitude will be given as 0 (THINK MAYBE GIVE SOMETHING DIFFERENT INSTEAD? 
     # FOR EXAMPLE JUST AMPLITIDU OF MOST POSITIVE AND MOST NEGATIVE VALUE OVER ALL GIVEN TIME?
     # HOWEVER THIS WILL NOT CORRESPOND TO PEAK TO PEAK IDEA).
 
-    if len(pairs_magnitudes)==0:
+    if not paired.any():
         return 0, None
 
-    amplitude=np.zeros(len(pairs_magnitudes),)
-    for i, pair in enumerate(pairs_magnitudes):
-        amplitude[i]=pair[0]-pair[1]
+    amplitude = pos_peak_magnitudes[paired] - neg_peak_magnitudes[closest_negative_peak_index[paired]]
 
     return np.mean(amplitude), amplitude
 
@@ -112,11 +103,16 @@ def get_ptp_all_data(data: mne.io.Raw, channels: list, sfreq: int, ptp_thresh_lv
         
     data_channels=data.get_data(picks = channels)
 
+    neg_ch_data=np.empty(data_channels.shape[1], dtype=data_channels.dtype) #one buffer for the negated channel, reused for all channels
+
+    #thresholds for all channels in one reduction (np.ptp instead of python max()-min(), which iterate element by element):
+    thresh_all=np.ptp(data_channels, axis=1) / ptp_thresh_lvl
+    #can also change the whole thresh to a single number setting
+
     peak_ampl_channels=[]
-    for one_ch_data in data_channels: 
+    for ch_ind, one_ch_data in enumerate(data_channels): 
 
-        thresh=(max(one_ch_data) - min(one_ch_data)) / ptp_thresh_lvl 
-        #can also change the whole thresh to a single number setting
+        thresh=thresh_all[ch_ind]
 
         #pos_peak_locs, pos_peak_magnitudes = mne.preprocessing.peak_finder(one_ch_data, extrema=1, thresh=thresh, verbose=False) #positive peaks
         #neg_peak_locs, neg_peak_magnitudes = mne.preprocessing.peak_finder(one_ch_data, extrema=-1, thresh=thresh, verbose=False) #negative peaks
@@ -125,7 +121,8 @@ def get_ptp_all_data(data: mne.io.Raw, channels: list, sfreq: int, ptp_thresh_lv
         pos_peak_locs, _ = find_peaks(one_ch_data, prominence=thresh) #assume there are no peaks within 0.5 seconds from each other.
         pos_peak_magnitudes = one_ch_data[pos_peak_locs]
 
-        neg_peak_locs, _ = find_peaks(-one_ch_data, prominence=thresh) #assume there are no peaks within 0.5 seconds from each other.
+        np.negative(one_ch_data, out=neg_ch_data) #negated data written into the buffer, no new full-length array per channel
+        neg_peak_locs, _ = find_peaks(neg_ch_data, prominence=thresh) #assume there are no peaks within 0.5 seconds from each other.
         neg_peak_magnitudes = one_ch_data[neg_peak_locs]
 
         # print('POS mne', pos_peak_locs, pos_peak_magnitudes)
@@ -171,17 +168,21 @@ def get_ptp_epochs(channels: list, epochs_mg: mne.Epochs, sfreq: int, ptp_thresh
         Dataframe containing the mean peak-to-peak aplitude for each epoch for each channel
 
     """
-    dict_ep = {}
+    #get the data of all epochs and channels once (shape: n_epochs, n_channels, n_times) instead of asking mne for every epoch+channel separately:
+    data_epochs=epochs_mg.get_data(picks=channels)
+
+    #thresholds for all epochs and channels in one reduction:
+    thresh_all=np.ptp(data_epochs, axis=2) / ptp_thresh_lvl
+    #can also change the whole thresh to a single number setting
+
+    #result table filled in place: rows - channels, columns - epochs:
+    peak_ampl_epochs=np.empty((len(channels), len(data_epochs)))
 
     #get 1 epoch, 1 channel and calculate PtP on its data:
-    for ep in range(0, len(epochs_mg)):
-        peak_ampl_epoch=[]
-        for ch_name in channels: 
-            data_ch_epoch=epochs_mg[ep].get_data(picks=ch_name)[0][0]
-            #[0][0] is because get_data creats array in array in array, it expects several epochs, several channels, but we only need  one.
-            
-            thresh=(max(data_ch_epoch) - min(data_ch_epoch)) / ptp_thresh_lvl 
-            #can also change the whole thresh to a single number setting
+    for ep, data_epoch in enumerate(data_epochs):
+        for ch_ind, data_ch_epoch in enumerate(data_epoch): 
+
+            thresh=thresh_all[ep, ch_ind]
 
             #pos_peak_locs, pos_peak_magnitudes = mne.preprocessing.peak_finder(data_ch_epoch, extrema=1, thresh=thresh, verbose=False) #positive peaks
             #neg_peak_locs, neg_peak_magnitudes = mne.preprocessing.peak_finder(data_ch_epoch, extrema=-1, thresh=thresh, verbose=False) #negative peaks
@@ -194,11 +195,9 @@ def get_ptp_epochs(channels: list, epochs_mg: mne.Epochs, sfreq: int, ptp_thresh
             neg_peak_magnitudes = data_ch_epoch[neg_peak_locs]
             
             pp_ampl,_=neighbour_peak_amplitude(max_pair_dist_sec, sfreq, pos_peak_locs, neg_peak_locs, pos_peak_magnitudes, neg_peak_magnitudes)
-            peak_ampl_epoch.append(pp_ampl)
-
-        dict_ep[ep] = peak_ampl_epoch
+            peak_ampl_epochs[ch_ind, ep]=pp_ampl
 
-    return pd.DataFrame(dict_ep, index=channels)
+    return pd.DataFrame(peak_ampl_epochs, index=channels, columns=range(len(data_epochs)))
 
 
 
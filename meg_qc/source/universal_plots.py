@@ -299,7 +299,10 @@ def plot_df_of_channels_data_as_lines_by_lobe(chs_by_lobe: dict, df_data: pd.Dat
 
     """
 
-    fig = go.Figure()
+    downsampling_factor = 5 #plot every 5th sample to keep the html report small
+    # Downsample while the traces are created, so every trace is built (and validated by plotly) only once:
+    x_values_downsampled = x_values[::downsampling_factor]
+
     traces_lobes=[]
     traces_chs=[]
     for lobe, ch_list in chs_by_lobe.items():
@@ -308,12 +311,12 @@ def plot_df_of_channels_data_as_lines_by_lobe(chs_by_lobe: dict, df_data: pd.Dat
         
         for ch_obj in ch_list:
             if ch_obj.name in df_data.columns:
-                ch_data=df_data[ch_obj.name].values
+                ch_data=df_data[ch_obj.name].values[::downsampling_factor]
                 color = ch_obj.lobe_color 
                 # normally color must be same for all channels in lobe, so we could assign it before the loop as the color of the first channel,
                 # but here it is done explicitly for every channel so that if there is any color error in chs_by_lobe, it will be visible
 
-                traces_chs += [go.Scatter(x=x_values, y=ch_data, line=dict(color=color), name=ch_obj.name, legendgroup=ch_obj.lobe, legendgrouptitle=dict(text=lobe.upper(), font=dict(color=color)))]
+                traces_chs += [go.Scatter(x=x_values_downsampled, y=ch_data, line=dict(color=color), name=ch_obj.name, legendgroup=ch_obj.lobe, legendgrouptitle=dict(text=lobe.upper(), font=dict(color=color)))]
                 #legendgrouptitle is group tile on the plot. legendgroup is not visible on the plot - it s used for sorting the legend items in update_layout() below.
 
     # sort traces in random order:
@@ -323,27 +326,8 @@ def plot_df_of_channels_data_as_lines_by_lobe(chs_by_lobe: dict, df_data: pd.Dat
 
 
 
-    downsampling_factor = 5  # replace with your desired downsampling factor
-    # Create a new list for the downsampled traces
-    traces_downsampled = []
-
-    # Go through each trace
-    for trace in traces:
-        # Downsample the x and y values of the trace
-        x_downsampled = trace['x'][::downsampling_factor]
-        y_downsampled = trace['y'][::downsampling_factor]
-
-        # Create a new trace with the downsampled values
-        trace_downsampled = go.Scatter(x=x_downsampled, y=y_downsampled, line=trace['line'], name=trace['name'], legendgroup=trace['legendgroup'], legendgrouptitle=trace['legendgrouptitle'])
-
-        # Add the downsampled trace to the list
-        traces_downsampled.append(trace_downsampled)
-
-
-
-
-    # Now first add these traces to the figure and only after that update the layout to make sure that the legend is grouped by lobe.
-    fig = go.Figure(data=traces_downsampled)
+    # Now first add these traces to the figure (all at once) and only after that update the layout to make sure that the legend is grouped by lobe.
+    fig = go.Figure(data=traces)
 
     fig.update_layout(legend_traceorder='grouped', legend_tracegroupgap=12, legend_groupclick='toggleitem')
     #You can make it so when you click on lobe title or any channel in lobe you activate/hide all related channels if u set legend_groupclick='togglegroup'.